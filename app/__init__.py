@@ -2,16 +2,41 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_socketio import SocketIO
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from config import Config
+import sqlite3
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'expire_on_commit': False})
 migrate = Migrate()
 socketio = SocketIO(cors_allowed_origins="*")
 
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL y synchronous=NORMAL: un commit ya no hace fsync del archivo"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA mmap_size=134217728')
+    cursor.close()
+
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    # Mantener activo el caché de sentencias compiladas de SQLAlchemy
+    engine_options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    engine_options.setdefault('query_cache_size', 1200)
+    engine_options.setdefault('pool_pre_ping', True)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
+    # Ajustar SQLite para escrituras frecuentes (un commit por request)
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite') and \
+            not event.contains(Engine, 'connect', set_sqlite_pragmas):
+        event.listen(Engine, 'connect', set_sqlite_pragmas)
+
     db.init_app(app)
     migrate.init_app(app, db)
     socketio.init_app(app)
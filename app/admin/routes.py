@@ -1,16 +1,77 @@
 from datetime import datetime, timedelta
-from flask import render_template, jsonify, request, current_app
+from flask import render_template, jsonify, request
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import selectinload
 from app.admin import bp
-from app.models import Order, MenuItem, TableToken
+from app.models import Order, OrderItem, TableToken
+from app.main.routes import invalidate_table_token
 from app import db
 import qrcode
 import base64
 from io import BytesIO
 import secrets
 
+# Dialectos con INSERT ... ON CONFLICT sobre el índice único parcial
+UPSERT_INSERTS = {
+    'sqlite': sqlite_insert,
+    'postgresql': postgresql_insert
+}
+
 def generate_table_token():
     return secrets.token_urlsafe(32)
 
+def _active_table_tokens(table_numbers):
+    """Map table number to its active TableToken, in one query."""
+    return {
+        token.table_number: token
+        for token in TableToken.query.filter(
+            TableToken.table_number.in_(table_numbers),
+            TableToken.is_active.is_(True)
+        )
+    }
+
+def _insert_table_tokens(table_numbers):
+    """
+    Insert one new active token per table number, without committing.
+    
+    On SQLite and PostgreSQL this is a single INSERT ... ON CONFLICT DO
+    NOTHING: if a concurrent request already created the active token for a
+    table, the partial unique index (ix_tt_active_true_table) drops that row
+    and the caller reads back the winner's token.
+    
+    Args:
+        table_numbers: List of integer table numbers without an active token
+    """
+    new_tokens = []
+    for table_number in table_numbers:
+        new_token = TableToken(
+            token=generate_table_token(),
+            table_number=table_number,
+            is_active=True
+        )
+        # Generate activation code
+        new_token.generate_activation_code()
+        new_tokens.append(new_token)
+    
+    insert = UPSERT_INSERTS.get(db.session.connection().dialect.name)
+    if insert is None:
+        db.session.add_all(new_tokens)
+        return
+    
+    db.session.execute(
+        insert(TableToken).values([{
+            'token': new_token.token,
+            'table_number': new_token.table_number,
+            'is_active': True,
+            'activation_code': new_token.activation_code,
+            'session_active': False
+        } for new_token in new_tokens]).on_conflict_do_nothing(
+            index_elements=['table_number'],
+            index_where=db.text('is_active')
+        )
+    )
+
 def get_or_create_table_token(table_number):
     """
     Get existing active token for table or create new one.
@@ -22,28 +83,40 @@ def get_or_create_table_token(table_number):
         TableToken instance (existing or newly created)
     """
     # Check for existing active token
-    existing_token = TableToken.query.filter_by(
-        table_number=table_number,
-        is_active=True
-    ).first()
+    existing_token = _active_table_tokens([table_number]).get(table_number)
     
     if existing_token:
         return existing_token
     
     # Create new token only if none exists
-    new_token = TableToken(
-        token=generate_table_token(),
-        table_number=table_number,
-        is_active=True
-    )
+    _insert_table_tokens([table_number])
+    db.session.commit()
     
-    # Generate activation code
-    new_token.generate_activation_code()
+    return _active_table_tokens([table_number])[table_number]
+
+def get_or_create_table_tokens(table_numbers):
+    """
+    Get or create active tokens for several tables with a single commit.
     
-    db.session.add(new_token)
-    db.session.commit()
+    Args:
+        table_numbers: Iterable of integer table numbers
+        
+    Returns:
+        List of TableToken instances, in the same order as table_numbers
+    """
+    table_numbers = list(table_numbers)
+    
+    # Check for existing active tokens in one query
+    tokens = _active_table_tokens(table_numbers)
+    
+    # Create the missing ones, commit once and read them back in one query
+    missing = [table_number for table_number in table_numbers if table_number not in tokens]
+    if missing:
+        _insert_table_tokens(missing)
+        db.session.commit()
+        tokens.update(_active_table_tokens(missing))
     
-    return new_token
+    return [tokens[table_number] for table_number in table_numbers]
 
 @bp.route('/qrgen')
 def qr_generator():
@@ -126,6 +199,7 @@ def activate_table():
     
     try:
         db.session.commit()
+        invalidate_table_token(table_token.token)
         return jsonify({
             'success': True,
             'table_number': table_token.table_number,
@@ -177,6 +251,7 @@ def deactivate_table():
         table_token.session_end = datetime.utcnow()
         
         db.session.commit()
+        invalidate_table_token(table_token.token)
         return jsonify({
             'success': True,
             'message': f'Mesa {table_number} desactivada correctamente'
@@ -195,7 +270,9 @@ def kitchen():
 @bp.route('/kitchen/orders')
 def get_kitchen_orders():
     # Obtener órdenes activas (no completadas)
-    active_orders = Order.query.filter_by(
+    active_orders = Order.query.options(
+        selectinload(Order.items).joinedload(OrderItem.menu_item)
+    ).filter_by(
         is_delivery=False,
         status='pending'
     ).order_by(Order.timestamp.desc()).all()
@@ -205,14 +282,14 @@ def get_kitchen_orders():
         items = []
         total = 0
         for item in order.items:
-            menu_item = MenuItem.query.get(item.menu_item_id)
+            # Mismo precio que ve el cliente en la confirmación
             item_data = {
-                'name': menu_item.name,
+                'name': item.menu_item.name if item.menu_item else 'Producto no disponible',
                 'quantity': item.quantity,
-                'price': menu_item.price
+                'price': item.price
             }
             items.append(item_data)
-            total += menu_item.price * item.quantity
+            total += item.price * item.quantity
             
         orders_data.append({
             'id': order.id,
@@ -1,9 +1,200 @@
-from flask import render_template, redirect, url_for, jsonify, request
+from flask import render_template, redirect, url_for, jsonify, request, current_app, make_response, abort
 from app.main import bp
 from app.models import MenuItem, TableToken, Order, OrderItem, db
 from app import socketio
-from flask_socketio import emit
+from sqlalchemy import inspect
+from sqlalchemy.orm import selectinload, load_only, make_transient_to_detached
 from datetime import datetime
+from threading import Lock
+from urllib.parse import quote
+from cachetools import TTLCache
+from werkzeug.exceptions import HTTPException
+
+# Caché en memoria del menú activo, que cambia muy poco entre requests
+_menu_cache = TTLCache(maxsize=1, ttl=60)
+_menu_cache_lock = Lock()
+MENU_CACHE_KEY = 'menu_v1'
+
+# Caché en memoria de tokens de mesa por string de token
+_token_cache = TTLCache(maxsize=4096, ttl=30)
+_token_cache_lock = Lock()
+
+# Segundos mínimos entre escrituras de TableToken.last_used
+LAST_USED_INTERVAL = 30
+
+# Ruta de main.order_confirmation, armada sin recorrer el URL map en cada pedido
+ORDER_CONFIRMATION_URL = '/order/confirmation/{order_id}?token={token}'
+
+def get_menu_categories():
+    """
+    Get available menu items grouped by category, cached for a short TTL.
+    
+    Returns:
+        Dict mapping category name to a list of serialized menu items
+    """
+    with _menu_cache_lock:
+        categories = _menu_cache.get(MENU_CACHE_KEY)
+    if categories is not None:
+        return categories
+    
+    # Query MenuItem table for all active items, in insertion order
+    menu_items = MenuItem.query.filter_by(available=True).order_by(MenuItem.id).all()
+    
+    # Group items by category, keeping categories in first-appearance order
+    categories = {}
+    for item in menu_items:
+        categories.setdefault(item.category or 'Other', []).append(item.to_dict())
+    
+    with _menu_cache_lock:
+        _menu_cache[MENU_CACHE_KEY] = categories
+    return categories
+
+def invalidate_menu_cache():
+    """Discard the cached menu so the next request reloads it."""
+    with _menu_cache_lock:
+        _menu_cache.clear()
+
+# Notificaciones de pedidos nuevos pendientes de enviar a cocina
+_pending_new_orders = []
+_pending_new_orders_lock = Lock()
+_new_orders_flusher_running = False
+
+# Segundos entre envíos de lotes de pedidos nuevos
+NEW_ORDERS_BATCH_INTERVAL = 0.05
+
+def queue_new_order_notification(order_id):
+    """
+    Queue a new order notification for the kitchen.
+    
+    Notifications are sent from a background task in batches, as a single
+    'new_orders_batch' event every NEW_ORDERS_BATCH_INTERVAL seconds, so the
+    request that created the order does not wait on the emit.
+    
+    Args:
+        order_id: ID of the newly created order
+    """
+    global _new_orders_flusher_running
+    
+    with _pending_new_orders_lock:
+        _pending_new_orders.append(order_id)
+        if _new_orders_flusher_running:
+            return
+        _new_orders_flusher_running = True
+    
+    socketio.start_background_task(_flush_new_orders, current_app._get_current_object())
+
+def _flush_new_orders(app):
+    """Emit queued order notifications until the queue stays empty."""
+    global _new_orders_flusher_running
+    
+    finished = False
+    try:
+        while True:
+            socketio.sleep(NEW_ORDERS_BATCH_INTERVAL)
+            
+            with _pending_new_orders_lock:
+                order_ids = list(_pending_new_orders)
+                _pending_new_orders.clear()
+                if not order_ids:
+                    _new_orders_flusher_running = False
+                    finished = True
+                    return
+            
+            try:
+                # Re-query only the columns the kitchen needs, one query per batch
+                with app.app_context():
+                    orders = Order.query.options(
+                        load_only(Order.id, Order.table_number, Order.is_delivery, Order.total)
+                    ).filter(Order.id.in_(order_ids)).order_by(Order.id).all()
+                    batch = [{
+                        'order_id': order.id,
+                        'table_number': order.table_number,
+                        'is_delivery': order.is_delivery,
+                        'total': order.total
+                    } for order in orders]
+                    db.session.remove()
+                
+                # Sin callback, python-socketio codifica el paquete una sola vez
+                # y lo reutiliza para todos los clientes conectados
+                if batch:
+                    socketio.emit('new_orders_batch', batch, namespace='/')
+            except Exception:
+                # Se descarta el lote; la cocina lo recupera en su próxima recarga
+                app.logger.exception('Error notifying new orders %s', order_ids)
+    finally:
+        # Si la tarea muere por otro motivo, no dejar bloqueadas las notificaciones
+        if not finished:
+            with _pending_new_orders_lock:
+                _new_orders_flusher_running = False
+
+def cache_table_token(table_token):
+    """Store a snapshot of the token's columns in the token cache."""
+    values = {
+        attr.key: getattr(table_token, attr.key)
+        for attr in inspect(TableToken).column_attrs
+    }
+    with _token_cache_lock:
+        _token_cache[table_token.token] = values
+
+def lookup_table_token(token_string):
+    """
+    Get a TableToken by token string, using a short-lived in-memory cache.
+    
+    Cached tokens are attached to the current session without querying the
+    database, so expiry and activity checks still run on the returned object.
+    
+    Args:
+        token_string: Token string from QR code
+        
+    Returns:
+        TableToken instance or None if the token does not exist
+    """
+    with _token_cache_lock:
+        values = _token_cache.get(token_string)
+    
+    if values is None:
+        table_token = TableToken.query.filter_by(token=token_string).first()
+        if table_token:
+            cache_table_token(table_token)
+        return table_token
+    
+    # Prefer the copy already loaded in this session, it may be newer
+    table_token = db.session.identity_map.get(
+        db.session.identity_key(TableToken, values['id'])
+    )
+    if table_token is not None:
+        return table_token
+    
+    table_token = TableToken(**values)
+    make_transient_to_detached(table_token)
+    return db.session.merge(table_token, load=False)
+
+def invalidate_table_token(token_string=None):
+    """Discard one cached token, or the whole token cache if none is given."""
+    with _token_cache_lock:
+        if token_string is None:
+            _token_cache.clear()
+        else:
+            _token_cache.pop(token_string, None)
+
+def get_menu_items_by_id(items):
+    """
+    Fetch the menu items referenced by an order in a single query.
+    
+    Args:
+        items: List of dicts with 'id' and 'quantity' keys
+        
+    Returns:
+        Dict mapping menu item id to MenuItem, or None if any id is unknown
+    """
+    ids = {int(item_data['id']) for item_data in items}
+    rows = MenuItem.query.filter(MenuItem.id.in_(ids)).all()
+    
+    menu_items = {menu_item.id: menu_item for menu_item in rows}
+    if len(menu_items) != len(ids):
+        return None
+    
+    return menu_items
 
 def create_order_from_token(token_string, customer_name, instructions, items):
     """
@@ -19,28 +210,27 @@ def create_order_from_token(token_string, customer_name, instructions, items):
         Order instance or None if token invalid
     """
     # Lookup token and extract table number
-    token = TableToken.query.filter_by(
-        token=token_string,
-        is_active=True
-    ).first()
+    token = lookup_table_token(token_string)
     
     # Verify token exists, is active, has table number, and not expired
-    if not token or not token.table_number:
+    if not token or not token.is_active or not token.table_number:
         return None
     
     # Check if token has expired (if session times are set)
     if token.session_end and datetime.utcnow() > token.session_end:
         return None
     
+    # Load all requested menu items in a single query
+    menu_items = get_menu_items_by_id(items)
+    if menu_items is None:
+        return None
+    
     # Calculate total
     total = 0
     order_items_data = []
     
     for item_data in items:
-        menu_item = MenuItem.query.get(int(item_data['id']))
-        if not menu_item:
-            return None
-        
+        menu_item = menu_items[int(item_data['id'])]
         quantity = int(item_data['quantity'])
         total += menu_item.price * quantity
         order_items_data.append((menu_item, quantity))
@@ -53,18 +243,25 @@ def create_order_from_token(token_string, customer_name, instructions, items):
         is_delivery=False,
         timestamp=datetime.utcnow()
     )
-    db.session.add(order)
     
-    # Add order items
-    for menu_item, quantity in order_items_data:
-        order_item = OrderItem(
-            order=order,
-            menu_item_id=menu_item.id,
-            quantity=quantity
-        )
-        db.session.add(order_item)
-    
-    db.session.commit()
+    # Add order and items without intermediate flushes, then commit once;
+    # a failed commit leaves the session clean for the caller
+    try:
+        with db.session.no_autoflush:
+            db.session.add(order)
+            db.session.add_all([
+                OrderItem(
+                    order=order,
+                    menu_item_id=menu_item.id,
+                    quantity=quantity,
+                    unit_price=menu_item.price
+                )
+                for menu_item, quantity in order_items_data
+            ])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
     return order
 
 @bp.route('/')
@@ -75,32 +272,28 @@ def index():
 
 @bp.route('/delivery')
 def delivery_menu():
-    menu_items = MenuItem.query.all()
+    menu_items = [item for items in get_menu_categories().values() for item in items]
     return render_template('menu/delivery_menu.html', menu_items=menu_items)
 
 @bp.route('/menu/<token>')
 def menu(token):
-    # Buscar el token en la base de datos
-    table_token = TableToken.query.filter_by(token=token).first()
+    # Buscar el token (caché en memoria o base de datos)
+    table_token = lookup_table_token(token)
     
     # Si el token no existe o no es válido, redirigir al menú de delivery
     if not table_token or not table_token.is_valid():
         return redirect(url_for('main.delivery_menu'))
     
-    # Actualizar último uso
-    table_token.last_used = datetime.utcnow()
-    db.session.commit()
+    # Actualizar último uso (como máximo una vez cada LAST_USED_INTERVAL segundos)
+    now = datetime.utcnow()
+    if not table_token.last_used or \
+            (now - table_token.last_used).total_seconds() > LAST_USED_INTERVAL:
+        table_token.last_used = now
+        db.session.commit()
+        cache_table_token(table_token)
     
-    # Query MenuItem table for all active items
-    menu_items = MenuItem.query.filter_by(available=True).all()
-    
-    # Group items by category
-    categories = {}
-    for item in menu_items:
-        category = item.category or 'Other'
-        if category not in categories:
-            categories[category] = []
-        categories[category].append(item)
+    # Menú agrupado por categoría (compartido entre requests)
+    categories = get_menu_categories()
     
     return render_template('menu/table_menu.html', 
                          categories=categories,
@@ -114,25 +307,39 @@ def payment_page():
 @bp.route('/order/confirmation/<int:order_id>')
 def order_confirmation(order_id):
     """Display order confirmation page"""
-    # Query Order with order_id
-    order = Order.query.get_or_404(order_id)
+    # Lightweight status query for the ETag; orders are immutable once placed
+    status = db.session.query(Order.status).filter_by(id=order_id).scalar()
+    if status is None:
+        abort(404)
+    etag = f'{order_id}-{status}'
     
-    # Calculate total from order items
-    total = sum(item.menu_item.price * item.quantity for item in order.items)
+    # Browser already has this page: answer 304 without loading the order
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        # Query Order with its items and menu items in one round-trip
+        order = Order.query.options(
+            selectinload(Order.items).joinedload(OrderItem.menu_item)
+        ).get_or_404(order_id)
+        
+        # Calculate total from the prices stored at order time
+        total = sum(item.price * item.quantity for item in order.items)
+        
+        # Render confirmation template with order data
+        response = make_response(render_template(
+            'menu/order_confirmation.html',
+            order=order,
+            total=total
+        ))
     
-    # Render confirmation template with order data
-    return render_template(
-        'menu/order_confirmation.html',
-        order=order,
-        total=total
-    )
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
 
 @bp.route('/create_order', methods=['POST'])
 def create_order():
-    print("Recibiendo pedido...")  # Debug print
     try:
-        data = request.get_json()
-        print(f"Datos recibidos: {data}")  # Debug print
+        data = request.get_json(cache=False, silent=True)
         
         if not data:
             return jsonify({'error': 'No se recibieron datos'}), 400
@@ -140,27 +347,29 @@ def create_order():
         items = data.get('items', [])
         is_delivery = data.get('is_delivery', False)
         token = data.get('token')
+        table_number = data.get('table_number', 0)
+        customer_name = data.get('customer_name', '')
+        instructions = data.get('special_instructions', '')
         
-        print(f"Items: {items}")  # Debug print
-        print(f"Is delivery: {is_delivery}")  # Debug print
-        print(f"Token: {token}")  # Debug print
+        # Liberar el payload antes del trabajo con la base de datos
+        del data
         
         if not items:
             return jsonify({'error': 'No hay items en el pedido'}), 400
         
         # Handle delivery orders (legacy path)
         if is_delivery:
-            table_number = data.get('table_number', 0)
+            # Load all requested menu items in a single query
+            menu_items = get_menu_items_by_id(items)
+            if menu_items is None:
+                return jsonify({'error': 'Uno o más items no fueron encontrados'}), 404
             
             # Calculate total
             total = 0
             order_items = []
             
             for item_data in items:
-                menu_item = MenuItem.query.get(int(item_data['id']))
-                if not menu_item:
-                    return jsonify({'error': f'Item con ID {item_data["id"]} no encontrado'}), 404
-                    
+                menu_item = menu_items[int(item_data['id'])]
                 quantity = int(item_data['quantity'])
                 total += menu_item.price * quantity
                 order_items.append((menu_item, quantity))
@@ -173,19 +382,20 @@ def create_order():
                 is_delivery=is_delivery,
                 timestamp=datetime.utcnow()
             )
-            db.session.add(order)
-            
-            # Add items to the order
-            for menu_item, quantity in order_items:
-                order_item = OrderItem(
-                    order=order,
-                    menu_item_id=menu_item.id,
-                    quantity=quantity
-                )
-                db.session.add(order_item)
             
+            # Add order and items without intermediate flushes, then commit once
+            with db.session.no_autoflush:
+                db.session.add(order)
+                db.session.add_all([
+                    OrderItem(
+                        order=order,
+                        menu_item_id=menu_item.id,
+                        quantity=quantity,
+                        unit_price=menu_item.price
+                    )
+                    for menu_item, quantity in order_items
+                ])
             db.session.commit()
-            print(f"Orden creada con ID: {order.id}")  # Debug print
         else:
             # Handle table orders using token
             if not token:
@@ -194,32 +404,34 @@ def create_order():
             # Use the new helper function
             order = create_order_from_token(
                 token_string=token,
-                customer_name=data.get('customer_name', ''),
-                instructions=data.get('special_instructions', ''),
+                customer_name=customer_name,
+                instructions=instructions,
                 items=items
             )
             
             if not order:
                 return jsonify({'error': 'Token inválido o mesa no encontrada'}), 400
-            
-            print(f"Orden creada con ID: {order.id}")  # Debug print
 
-        # Emit WebSocket event to notify kitchen
-        socketio.emit('new_order', {
-            'order_id': order.id,
-            'table_number': order.table_number,
-            'is_delivery': order.is_delivery,
-            'total': order.total
-        }, namespace='/')
+        current_app.logger.debug('Orden creada con ID: %s', order.id)
+
+        # Notify kitchen from a background task
+        queue_new_order_notification(order.id)
 
         return jsonify({
             'success': True,
             'order_id': order.id,
-            'redirect_url': url_for('main.order_confirmation', order_id=order.id, token=token if not is_delivery else ''),
+            'redirect_url': request.script_root + ORDER_CONFIRMATION_URL.format(
+                order_id=order.id,
+                token=quote(token if not is_delivery and token else '', safe='')
+            ),
             'message': 'Pedido creado exitosamente'
         })
             
+    except HTTPException:
+        # Errores HTTP (p. ej. 413 por MAX_CONTENT_LENGTH) llegan tal cual
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
-        print(f"Error al procesar el pedido: {str(e)}")  # Debug print
+        current_app.logger.exception('Error al procesar el pedido')
         return jsonify({'error': f'Error al procesar el pedido: {str(e)}'}), 500
@@ -11,6 +11,17 @@ class MenuItem(db.Model):
     available = db.Column(db.Boolean, default=True)
     image_url = db.Column(db.String(256))
 
+    def to_dict(self):
+        """Serializar el item para cachearlo fuera de la sesión"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'price': self.price,
+            'category': self.category,
+            'image_url': self.image_url
+        }
+
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     table_number = db.Column(db.Integer, nullable=False)
@@ -27,11 +38,19 @@ class OrderItem(db.Model):
     order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
     menu_item_id = db.Column(db.Integer, db.ForeignKey('menu_item.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
+    unit_price = db.Column(db.Float)  # Precio al momento de la venta
     notes = db.Column(db.String(256))
     
     # Add relationship to MenuItem
     menu_item = db.relationship('MenuItem', backref='order_items', lazy=True)
 
+    @property
+    def price(self):
+        """Precio unitario cobrado; filas antiguas sin unit_price usan el precio actual"""
+        if self.unit_price is not None:
+            return self.unit_price
+        return self.menu_item.price if self.menu_item else 0.0
+
 class TableToken(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     table_number = db.Column(db.Integer, nullable=False)
@@ -43,6 +62,16 @@ class TableToken(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_used = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_tt_active_table', 'is_active', 'table_number'),
+        # Índice único parcial: un solo token activo por mesa (PostgreSQL y SQLite)
+        db.Index(
+            'ix_tt_active_true_table', 'table_number', unique=True,
+            postgresql_where=db.text('is_active'),
+            sqlite_where=db.text('is_active')
+        ),
+    )
     
     def is_valid(self):
         """Verificar si el token es válido basado en reglas de negocio"""
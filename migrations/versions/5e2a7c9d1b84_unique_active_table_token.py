@@ -0,0 +1,46 @@
+"""one active token per table
+
+Revision ID: 5e2a7c9d1b84
+Revises: f41a9d3c6b28
+Create Date: 2026-10-15 12:40:03.218554
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2a7c9d1b84'
+down_revision = 'f41a9d3c6b28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Antes del índice único: dejar activo solo el token más reciente de cada
+    # mesa (el antiguo SELECT-then-INSERT podía duplicarlos)
+    table_token = sa.table(
+        'table_token',
+        sa.column('id', sa.Integer),
+        sa.column('table_number', sa.Integer),
+        sa.column('is_active', sa.Boolean)
+    )
+    newest_active = sa.select(sa.func.max(table_token.c.id)).where(
+        table_token.c.is_active == sa.true()
+    ).group_by(table_token.c.table_number)
+    op.execute(
+        table_token.update().where(
+            table_token.c.is_active == sa.true(),
+            table_token.c.id.notin_(newest_active)
+        ).values(is_active=False)
+    )
+
+    op.drop_index('ix_tt_active_true_table', table_name='table_token')
+    op.create_index('ix_tt_active_true_table', 'table_token', ['table_number'], unique=True,
+                    postgresql_where=sa.text('is_active'), sqlite_where=sa.text('is_active'))
+
+
+def downgrade():
+    op.drop_index('ix_tt_active_true_table', table_name='table_token')
+    op.create_index('ix_tt_active_true_table', 'table_token', ['table_number'], unique=False,
+                    postgresql_where=sa.text('is_active'), sqlite_where=sa.text('is_active'))
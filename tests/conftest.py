@@ -4,35 +4,128 @@ Test configuration and fixtures for RestQR tests.
 import pytest
 import sys
 import os
+from hypothesis import settings, Phase, HealthCheck
+from hypothesis.database import DirectoryBasedExampleDatabase
+from sqlalchemy import event
+from sqlalchemy.orm import raiseload
+from sqlalchemy.pool import StaticPool
 
 # Add parent directory to path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from app import create_app, db
 from app.models import TableToken, MenuItem, Order, OrderItem
+from app.main.routes import invalidate_menu_cache, invalidate_table_token
+from app.admin.routes import get_or_create_table_tokens
 from config import Config
 
 
+# Hypothesis profile without the shrink phase, since every example hits the
+# database; failures already seen are replayed from .hypothesis/examples
+settings.register_profile(
+    'ci',
+    max_examples=20,
+    phases=[Phase.explicit, Phase.reuse, Phase.generate],
+    deadline=None,
+    database=DirectoryBasedExampleDatabase('.hypothesis/examples'),
+    suppress_health_check=[HealthCheck.function_scoped_fixture]
+)
+settings.load_profile(os.environ.get('HYPOTHESIS_PROFILE', 'ci'))
+
+
+# Tables whose token is created once per session (see token_factory)
+FACTORY_TABLES = range(1, 31)
+
+
 class TestConfig(Config):
     """Test configuration."""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    # A single in-memory connection shared by every test
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'connect_args': {'check_same_thread': False},
+        'poolclass': StaticPool
+    }
     WTF_CSRF_ENABLED = False
     SECRET_KEY = 'test-secret-key'
 
 
-@pytest.fixture(scope='function')
+def _sqlite_autocommit(dbapi_connection, connection_record):
+    """Let SQLAlchemy, not pysqlite, emit BEGIN so SAVEPOINTs work."""
+    dbapi_connection.isolation_level = None
+
+
+def _sqlite_begin(connection):
+    connection.exec_driver_sql('BEGIN')
+
+
+@pytest.fixture(scope='session')
 def app():
-    """Create and configure a test app instance."""
+    """
+    Create the test app and its schema once for the whole session.
+    
+    The application context stays pushed until the session ends, so tests
+    and fixtures never need their own app.app_context().
+    """
     app = create_app(TestConfig)
     
     with app.app_context():
+        event.listen(db.engine, 'connect', _sqlite_autocommit)
+        event.listen(db.engine, 'begin', _sqlite_begin)
         db.create_all()
         yield app
         db.session.remove()
         db.drop_all()
 
 
+@pytest.fixture(scope='session')
+def standard_menu(app):
+    """
+    Menu items committed once for the whole session, keyed by name.
+    
+    Session fixtures are set up before db_session, so these rows live
+    outside every test's transaction. Tests should only reference them.
+    """
+    items = {
+        'California Roll': MenuItem(name="California Roll", description="Fresh salmon and avocado",
+                                    price=12.50, category="Rolls", available=True),
+        'Miso Soup': MenuItem(name="Miso Soup", description="Traditional Japanese soup",
+                              price=4.50, category="Appetizers", available=True),
+        'Tempura Roll': MenuItem(name="Tempura Roll", description="Crispy tempura",
+                                 price=14.00, category="Rolls", available=True),
+        'Edamame': MenuItem(name="Edamame", description="Steamed soybeans",
+                            price=5.00, category="Appetizers", available=True),
+        'Sashimi Platter': MenuItem(name="Sashimi Platter", description="Assorted fresh fish",
+                                    price=25.00, category="Sashimi", available=True),
+        'Ramen Bowl': MenuItem(name="Ramen Bowl", description="Traditional ramen",
+                               price=12.00, category="Noodles", available=True),
+    }
+    db.session.bulk_save_objects(list(items.values()), return_defaults=True)
+    db.session.commit()
+    return items
+
+
+@pytest.fixture(scope='session')
+def token_factory(app):
+    """
+    Return the token string for a table number in FACTORY_TABLES.
+    
+    Tokens are created once, with a single commit, before any test
+    transaction starts, so they survive each test's rollback.
+    """
+    tokens = {
+        token.table_number: token.token
+        for token in get_or_create_table_tokens(FACTORY_TABLES)
+    }
+    # Close the read-back transaction on the shared connection
+    db.session.remove()
+    
+    def make(table_number):
+        return tokens[table_number]
+    
+    return make
+
+
 @pytest.fixture(scope='function')
 def client(app):
     """Create a test client."""
@@ -43,6 +136,59 @@ def client(app):
 
 @pytest.fixture(scope='function')
 def db_session(app):
-    """Create a database session for tests."""
-    with app.app_context():
-        yield db.session
+    """
+    Run each test inside an outer transaction that is rolled back afterwards.
+    
+    The session is bound to a single connection with a SAVEPOINT, so code
+    under test can commit and roll back freely; a new SAVEPOINT is opened
+    whenever the previous one ends.
+    """
+    invalidate_menu_cache()
+    invalidate_table_token()
+    
+    connection = db.engine.connect()
+    transaction = connection.begin()
+    # Same session_options as SQLAlchemy(...) in app/__init__.py
+    session = db.create_scoped_session(options={
+        'bind': connection,
+        'binds': {},
+        'expire_on_commit': False
+    })
+    nested = connection.begin_nested()
+    
+    @event.listens_for(session, 'after_transaction_end')
+    def restart_savepoint(session, trans):
+        nonlocal nested
+        if not nested.is_active:
+            nested = connection.begin_nested()
+    
+    original_session = db.session
+    db.session = session
+    
+    yield session
+    
+    session.remove()
+    transaction.rollback()
+    connection.close()
+    db.session = original_session
+
+
+@pytest.fixture(scope='function')
+def raise_on_lazy_load(db_session):
+    """
+    Make lazy relationship loads raise for objects loaded during the test.
+    
+    Every top-level ORM SELECT gets raiseload('*'), so relationships that
+    were not eager-loaded fail loudly instead of issuing one query per row.
+    """
+    def add_raiseload(orm_execute_state):
+        if orm_execute_state.is_select and \
+                not orm_execute_state.is_relationship_load and \
+                not orm_execute_state.is_column_load:
+            orm_execute_state.statement = orm_execute_state.statement.options(
+                raiseload('*')
+            )
+    
+    event.listen(db_session, 'do_orm_execute', add_raiseload)
+    yield
+    event.remove(db_session, 'do_orm_execute', add_raiseload)
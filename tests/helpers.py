@@ -0,0 +1,47 @@
+"""
+Shared helpers for RestQR tests.
+"""
+import contextlib
+from sqlalchemy import event
+from app.main.routes import create_order_from_token
+
+
+def make_order(token, menu_item, qty=1, name='C', instr=''):
+    """
+    Place a single-item order for a table token.
+    
+    Args:
+        token: TableToken or token string
+        menu_item: MenuItem to order
+        qty: Quantity of menu_item
+        name: Customer name
+        instr: Special instructions
+        
+    Returns:
+        Order object if successful, None otherwise
+    """
+    return create_order_from_token(
+        token_string=getattr(token, 'token', token),
+        customer_name=name,
+        instructions=instr,
+        items=[{'id': menu_item.id, 'quantity': qty}]
+    )
+
+
+@contextlib.contextmanager
+def count_queries(connection):
+    """
+    Collect every SQL statement executed on connection inside the block.
+    
+    Usage: with count_queries(db.session.connection()) as queries: ...
+    """
+    queries = []
+    
+    def record(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+    
+    event.listen(connection, 'before_cursor_execute', record)
+    try:
+        yield queries
+    finally:
+        event.remove(connection, 'before_cursor_execute', record)
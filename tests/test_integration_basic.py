@@ -2,98 +2,213 @@
 Basic integration tests for token and order tracking.
 """
 import pytest
+from datetime import datetime, timedelta
 from app.models import TableToken, Order, MenuItem, OrderItem
 from app.admin.routes import get_or_create_table_token
-from app.main.routes import create_order_from_token
+from app.main.routes import (
+    create_order_from_token,
+    get_menu_categories,
+    invalidate_menu_cache,
+    lookup_table_token,
+    invalidate_table_token,
+    menu,
+    LAST_USED_INTERVAL,
+    _token_cache
+)
 from app import db
+from tests.helpers import count_queries
 
 
-def test_token_creation_and_reuse(app, db_session):
+def test_token_creation_and_reuse(db_session):
     """Test that tokens are created and reused correctly."""
-    with app.app_context():
-        # Create a token for table 5
-        token1 = get_or_create_table_token(5)
-        assert token1 is not None
-        assert token1.table_number == 5
-        assert token1.is_active is True
-        
-        # Try to create another token for the same table
-        token2 = get_or_create_table_token(5)
-        assert token2.id == token1.id
-        assert token2.token == token1.token
-        
-        print("✓ Token creation and reuse works correctly")
-
-
-def test_order_creation_with_table_number(app, db_session):
+    # Create a token for table 5
+    token1 = get_or_create_table_token(5)
+    assert token1 is not None
+    assert token1.table_number == 5
+    assert token1.is_active is True
+    
+    # Try to create another token for the same table
+    token2 = get_or_create_table_token(5)
+    assert token2.id == token1.id
+    assert token2.token == token1.token
+    
+    print("✓ Token creation and reuse works correctly")
+
+
+def test_order_creation_with_table_number(db_session, standard_menu):
     """Test that orders are created with table numbers from tokens."""
-    with app.app_context():
-        # Create a token for table 10
-        token = get_or_create_table_token(10)
-        
-        # Create a menu item for testing
-        menu_item = MenuItem(
-            name="Test Sushi",
-            description="Test item",
-            price=10.0,
-            category="Test",
-            available=True
-        )
-        db.session.add(menu_item)
-        db.session.commit()
-        
-        # Create an order using the token
-        items = [{'id': menu_item.id, 'quantity': 2}]
-        order = create_order_from_token(
-            token_string=token.token,
-            customer_name="Test Customer",
-            instructions="No wasabi",
-            items=items
-        )
-        
-        assert order is not None
-        assert order.table_number == 10
-        assert order.status == 'pending'
-        assert len(order.items) == 1
-        assert order.items[0].quantity == 2
-        
-        print("✓ Order creation with table number works correctly")
-
-
-def test_order_creation_with_invalid_token(app, db_session):
+    # Create a token for table 10
+    token = get_or_create_table_token(10)
+    
+    menu_item = standard_menu['California Roll']
+    
+    # Create an order using the token
+    items = [{'id': menu_item.id, 'quantity': 2}]
+    order = create_order_from_token(
+        token_string=token.token,
+        customer_name="Test Customer",
+        instructions="No wasabi",
+        items=items
+    )
+    
+    assert order is not None
+    assert order.table_number == 10
+    assert order.status == 'pending'
+    assert len(order.items) == 1
+    assert order.items[0].quantity == 2
+    
+    print("✓ Order creation with table number works correctly")
+
+
+def test_order_creation_with_invalid_token(db_session):
     """Test that orders fail with invalid tokens."""
-    with app.app_context():
-        # Try to create an order with a non-existent token
-        order = create_order_from_token(
-            token_string="invalid_token_12345",
-            customer_name="Test Customer",
-            instructions="",
-            items=[{'id': 1, 'quantity': 1}]
-        )
-        
-        assert order is None
-        print("✓ Invalid token rejection works correctly")
-
-
-def test_inactive_token_rejection(app, db_session):
+    # Try to create an order with a non-existent token
+    order = create_order_from_token(
+        token_string="invalid_token_12345",
+        customer_name="Test Customer",
+        instructions="",
+        items=[{'id': 1, 'quantity': 1}]
+    )
+    
+    assert order is None
+    print("✓ Invalid token rejection works correctly")
+
+
+def test_inactive_token_rejection(db_session):
     """Test that orders fail when token is inactive."""
-    with app.app_context():
-        # Create an inactive token
-        inactive_token = TableToken(
-            token="inactive_token_123",
-            table_number=15,
-            is_active=False
-        )
-        db.session.add(inactive_token)
-        db.session.commit()
-        
-        # Try to create an order with this token
-        order = create_order_from_token(
-            token_string=inactive_token.token,
-            customer_name="Test Customer",
-            instructions="",
-            items=[{'id': 1, 'quantity': 1}]
-        )
-        
-        assert order is None
-        print("✓ Inactive token rejection works correctly")
+    # Create an inactive token
+    inactive_token = TableToken(
+        token="inactive_token_123",
+        table_number=15,
+        is_active=False
+    )
+    db.session.add(inactive_token)
+    db.session.commit()
+    
+    # Try to create an order with this token
+    order = create_order_from_token(
+        token_string=inactive_token.token,
+        customer_name="Test Customer",
+        instructions="",
+        items=[{'id': 1, 'quantity': 1}]
+    )
+    
+    assert order is None
+    print("✓ Inactive token rejection works correctly")
+
+
+def test_order_creation_with_unknown_menu_item(db_session, standard_menu):
+    """Test that orders fail when any requested menu item does not exist."""
+    token = get_or_create_table_token(11)
+    
+    menu_item = standard_menu['California Roll']
+    
+    # One valid item and one id that does not exist
+    order = create_order_from_token(
+        token_string=token.token,
+        customer_name="Test Customer",
+        instructions="",
+        items=[
+            {'id': menu_item.id, 'quantity': 1},
+            {'id': menu_item.id + 1000, 'quantity': 1}
+        ]
+    )
+    
+    assert order is None
+    assert Order.query.count() == 0
+    print("✓ Unknown menu item rejection works correctly")
+
+
+def test_menu_categories_are_cached(db_session):
+    """Test that the grouped menu is cached until invalidated."""
+    db.session.bulk_save_objects([
+        MenuItem(name="Sake Roll", price=8.0, category="Handrolls", available=True),
+        MenuItem(name="Wasabi", price=0.5, category="", available=True),
+        MenuItem(name="Ramune", price=2.5, category="Bebidas", available=True),
+        MenuItem(name="Old Roll", price=1.0, category="Handrolls", available=False),
+        MenuItem(name="Gari", price=0.5, category="Other", available=True)
+    ])
+    db.session.commit()
+    
+    # Categories keep the order in which they were first added
+    categories = get_menu_categories()
+    assert list(categories).index("Handrolls") < list(categories).index("Bebidas")
+    assert [item['name'] for item in categories["Handrolls"]] == ["Sake Roll"]
+    
+    # Items without a category and items in 'Other' end up in the same group
+    assert [item['name'] for item in categories["Other"]] == ["Wasabi", "Gari"]
+    
+    # New items are not visible until the cache is invalidated
+    db.session.add(MenuItem(name="Ebi Roll", price=9.0, category="Handrolls", available=True))
+    db.session.commit()
+    assert get_menu_categories() is categories
+    
+    invalidate_menu_cache()
+    categories = get_menu_categories()
+    assert [item['name'] for item in categories["Handrolls"]] == ["Sake Roll", "Ebi Roll"]
+    
+    print("✓ Menu category caching works correctly")
+
+
+def test_token_lookup_is_cached_until_invalidated(db_session):
+    """Test that token lookups are served from cache until invalidated."""
+    token = get_or_create_table_token(12)
+    token_string = token.token
+    
+    assert lookup_table_token(token_string).table_number == 12
+    
+    # Deactivate behind the cache's back and start a fresh session
+    TableToken.query.filter_by(token=token_string).update({'is_active': False})
+    db.session.commit()
+    db.session.expunge_all()
+    
+    cached = lookup_table_token(token_string)
+    assert cached.is_active is True
+    
+    invalidate_table_token(token_string)
+    db.session.expunge_all()
+    
+    order = create_order_from_token(
+        token_string=token_string,
+        customer_name="Test Customer",
+        instructions="",
+        items=[{'id': 1, 'quantity': 1}]
+    )
+    assert order is None
+    assert lookup_table_token(token_string).is_active is False
+    
+    print("✓ Token lookup caching works correctly")
+
+
+def test_menu_debounces_last_used_updates(app, db_session):
+    """Test that the table menu writes last_used at most once per interval."""
+    token = get_or_create_table_token(13)
+    token.session_active = True
+    db.session.commit()
+    token_string = token.token
+    
+    def open_menu():
+        with app.test_request_context(f'/menu/{token_string}'):
+            with count_queries(db.session.connection()) as queries:
+                response = menu(token_string)
+        assert isinstance(response, str)
+        return [q for q in queries if q.startswith('UPDATE table_token')]
+    
+    # First visit records last_used, a second one right after does not
+    assert len(open_menu()) == 1
+    first_used = TableToken.query.filter_by(token=token_string).one().last_used
+    assert open_menu() == []
+    assert TableToken.query.filter_by(token=token_string).one().last_used == first_used
+    
+    # A stale last_used is bumped and the cached snapshot refreshed
+    stale = datetime.utcnow() - timedelta(seconds=LAST_USED_INTERVAL * 2)
+    TableToken.query.filter_by(token=token_string).update({'last_used': stale})
+    db.session.commit()
+    invalidate_table_token(token_string)
+    db.session.expunge_all()
+    
+    assert len(open_menu()) == 1
+    assert _token_cache[token_string]['last_used'] > stale
+    assert TableToken.query.filter_by(token=token_string).one().last_used > stale
+    
+    print("✓ Menu last_used debounce works correctly")
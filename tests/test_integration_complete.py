@@ -4,212 +4,263 @@ Integration tests for complete order flow and system functionality.
 Feature: restqr-critical-fixes
 Tests the complete end-to-end flows including QR generation, menu viewing,
 cart operations, order submission, and confirmation.
+
+Tests that render the confirmation page or the kitchen view use the
+raise_on_lazy_load fixture, so a missing selectinload(...) in those views
+fails the test instead of hiding an N+1 query.
 """
 import pytest
 import json
 from app.models import TableToken, MenuItem, Order, OrderItem
-from app.admin.routes import get_or_create_table_token
-from app.main.routes import create_order_from_token
+from app.admin.routes import get_or_create_table_token, get_kitchen_orders
+from flask import url_for
+from werkzeug.exceptions import RequestEntityTooLarge
+from sqlalchemy.orm import selectinload, raiseload
+from app.main.routes import (
+    create_order,
+    create_order_from_token,
+    order_confirmation,
+    ORDER_CONFIRMATION_URL
+)
 from app import db
+from tests.helpers import make_order, count_queries
 
 
-def test_complete_order_flow(app, db_session):
+@pytest.mark.slow
+@pytest.mark.parametrize('table_number, qty1, qty2', [(7, 2, 1), (15, 1, 2), (20, 2, 1)])
+def test_complete_order_flow(db_session, standard_menu, token_factory,
+                             table_number, qty1, qty2):
     """
     Integration test: QR scan → menu view → add items → submit → confirmation
     
     Tests the complete customer journey from scanning a QR code to receiving
-    order confirmation, verifying table number tracking throughout.
+    order confirmation, then placing a second order from the same table
+    (page refresh / repeat order), verifying table number tracking and
+    token reuse throughout.
     
     Validates: All requirements
     """
-    with app.app_context():
-        # Step 1: Admin generates QR code for table 7
-        token = get_or_create_table_token(7)
-        assert token is not None
-        assert token.table_number == 7
-        assert token.is_active is True
-        
-        # Step 2: Create menu items in database
-        menu_item1 = MenuItem(
-            name="California Roll",
-            description="Fresh salmon and avocado",
-            price=12.50,
-            category="Rolls",
-            available=True
-        )
-        menu_item2 = MenuItem(
-            name="Miso Soup",
-            description="Traditional Japanese soup",
-            price=4.50,
-            category="Appetizers",
-            available=True
-        )
-        db.session.add(menu_item1)
-        db.session.add(menu_item2)
-        db.session.commit()
-        
-        # Step 3: Verify token is valid and can be used to query menu items
-        menu_items = MenuItem.query.filter_by(available=True).all()
-        assert len(menu_items) == 2
-        assert any(item.name == "California Roll" for item in menu_items)
-        assert any(item.name == "Miso Soup" for item in menu_items)
-        
-        # Step 4: Customer adds items to cart and submits order
-        items = [
-            {'id': menu_item1.id, 'quantity': 2},
-            {'id': menu_item2.id, 'quantity': 1}
-        ]
-        
-        order = create_order_from_token(
-            token_string=token.token,
-            customer_name='John Doe',
-            instructions='Extra wasabi please',
-            items=items
-        )
-        
-        # Step 5: Verify order was created with correct table number
-        assert order is not None
-        assert order.table_number == 7
-        assert order.status == 'pending'
-        assert len(order.items) == 2
-        
-        # Verify order items
-        order_items = {item.menu_item_id: item.quantity for item in order.items}
-        assert order_items[menu_item1.id] == 2
-        assert order_items[menu_item2.id] == 1
-        
-        # Verify total calculation
-        expected_total = (12.50 * 2) + (4.50 * 1)
-        assert order.total == expected_total
-        
-        # Step 6: Verify order can be retrieved for confirmation page
-        retrieved_order = Order.query.get(order.id)
+    # Step 1: Admin generates QR code for the table
+    token_string = token_factory(table_number)
+    token = TableToken.query.filter_by(token=token_string).first()
+    assert token is not None
+    assert token.table_number == table_number
+    assert token.is_active is True
+    
+    # Step 2: Menu items are available
+    menu_item1 = standard_menu['California Roll']
+    menu_item2 = standard_menu['Miso Soup']
+    
+    # Step 3: Verify token is valid and can be used to query menu items
+    menu_names = {item.name for item in MenuItem.query.filter_by(available=True)}
+    assert {"California Roll", "Miso Soup"} <= menu_names
+    
+    # Step 4: Customer adds items to cart and submits order
+    items = [
+        {'id': menu_item1.id, 'quantity': qty1},
+        {'id': menu_item2.id, 'quantity': qty2}
+    ]
+    
+    order = create_order_from_token(
+        token_string=token_string,
+        customer_name='John Doe',
+        instructions='Extra wasabi please',
+        items=items
+    )
+    
+    # Step 5: Verify order was created with correct table number
+    assert order is not None
+    assert order.table_number == table_number
+    assert order.status == 'pending'
+    assert len(order.items) == 2
+    
+    # Verify order items
+    order_items = {item.menu_item_id: item.quantity for item in order.items}
+    assert order_items[menu_item1.id] == qty1
+    assert order_items[menu_item2.id] == qty2
+    
+    # Verify total calculation
+    expected_total = (12.50 * qty1) + (4.50 * qty2)
+    assert order.total == expected_total
+    
+    # Step 6: Verify order can be retrieved for confirmation page, as a
+    # fresh request would: items and menu items eager-loaded, any other
+    # lazy load raises instead of silently issuing a query
+    db.session.expunge_all()
+    with count_queries(db.session.connection()) as queries:
+        retrieved_order = db.session.query(Order).options(
+            selectinload(Order.items).joinedload(OrderItem.menu_item),
+            raiseload('*')
+        ).get(order.id)
         assert retrieved_order is not None
-        assert retrieved_order.table_number == 7
-        
-        # Calculate total for confirmation (query menu items)
-        confirmation_total = 0
-        for item in retrieved_order.items:
-            menu_item = MenuItem.query.get(item.menu_item_id)
-            confirmation_total += menu_item.price * item.quantity
-        assert confirmation_total == expected_total
+        assert retrieved_order.table_number == table_number
         
-        print("✓ Complete order flow integration test passed")
+        # Calculate total for confirmation from the preloaded menu items
+        confirmation_total = sum(
+            oi.menu_item.price * oi.quantity for oi in retrieved_order.items
+        )
+    # One query for the order, one for its items with their menu items
+    assert len(queries) <= 2
+    assert confirmation_total == expected_total
+    
+    # Step 7: Same table orders again with the same token
+    order2 = make_order(token_string, menu_item1, qty2, name='Second Order')
+    
+    assert order2 is not None
+    assert order2.table_number == table_number
+    assert order2.id != retrieved_order.id
+    
+    # Verify both orders exist with same table
+    orders = Order.query.filter_by(table_number=table_number).all()
+    assert len(orders) == 2
+    
+    # Verify token was reused (only one active token exists for the table)
+    tokens = TableToken.query.filter_by(table_number=table_number, is_active=True).all()
+    assert len(tokens) == 1
+    
+    print("✓ Complete order flow integration test passed")
 
 
-def test_cart_persistence_across_page_refresh(app, db_session):
+def test_order_confirmation_uses_price_at_order_time(app, db_session, raise_on_lazy_load):
+    """
+    Integration test: Confirmation total uses the price stored on each item
+    
+    Tests that changing a menu item's price after an order is placed does
+    not change the total shown on the confirmation page.
     """
-    Integration test: Verify cart persists across page refreshes
+    token = get_or_create_table_token(9)
+    
+    menu_item = MenuItem(
+        name="Tuna Roll",
+        description="Fresh tuna",
+        price=10.00,
+        category="Rolls",
+        available=True
+    )
+    db.session.bulk_save_objects([menu_item], return_defaults=True)
+    db.session.commit()
+    
+    order = make_order(token, menu_item, 3)
+    assert order.items[0].unit_price == 10.00
     
-    Tests that cart state stored in localStorage (simulated via session)
-    remains consistent when customer navigates between pages.
+    # Price changes after the order was placed
+    MenuItem.query.get(menu_item.id).price = 99.00
+    db.session.commit()
     
-    Validates: Requirements 3.1, 3.2, 3.3
+    # Render from an empty session, as a fresh request would
+    order_id = order.id
+    db.session.expunge_all()
+    
+    with app.test_request_context(f'/order/confirmation/{order_id}'):
+        html = order_confirmation(order_id).get_data(as_text=True)
+    assert '$30' in html
+    assert '$297' not in html
+    
+    # Kitchen shows the same total as the customer
+    with app.test_request_context('/admin/kitchen/orders'):
+        kitchen_orders = get_kitchen_orders().get_json()['orders']
+    kitchen_order = next(o for o in kitchen_orders if o['id'] == order_id)
+    assert kitchen_order['items'][0]['price'] == 10.00
+    assert kitchen_order['total'] == 30.00
+    
+    print("✓ Order confirmation price-at-order-time integration test passed")
+
+
+def test_order_confirmation_without_unit_price(app, db_session, raise_on_lazy_load,
+                                              standard_menu):
     """
-    with app.app_context():
-        # Create token and menu items
-        token = get_or_create_table_token(15)
-        
-        menu_item = MenuItem(
-            name="Salmon Nigiri",
-            description="Fresh salmon",
-            price=8.00,
-            category="Nigiri",
-            available=True
-        )
-        db.session.add(menu_item)
-        db.session.commit()
-        
-        # Verify token is valid and menu items can be queried
-        assert token.table_number == 15
-        assert token.is_active is True
-        
-        # Verify menu items are available
-        menu_items = MenuItem.query.filter_by(available=True).all()
-        assert len(menu_items) == 1
-        assert menu_items[0].name == "Salmon Nigiri"
-        
-        # Simulate cart operations - verify data consistency
-        # In real app, cart is managed client-side in localStorage
-        # Here we verify the backend data remains consistent
-        
-        # Create multiple orders to simulate page refreshes
-        order1 = create_order_from_token(
-            token_string=token.token,
-            customer_name='Customer 1',
-            instructions='',
-            items=[{'id': menu_item.id, 'quantity': 1}]
-        )
-        
-        # Verify table number persists across operations
-        assert order1.table_number == 15
-        
-        # Simulate another "page refresh" - create another order
-        order2 = create_order_from_token(
-            token_string=token.token,
-            customer_name='Customer 2',
-            instructions='',
-            items=[{'id': menu_item.id, 'quantity': 2}]
-        )
-        
-        # Verify table number still consistent
-        assert order2.table_number == 15
-        
-        # Verify both orders exist with same table
-        orders = Order.query.filter_by(table_number=15).all()
-        assert len(orders) == 2
+    Integration test: Items stored before unit_price existed still render
+    
+    Tests that order items with a NULL unit_price (rows the migration could
+    not backfill) fall back to the current menu price instead of failing.
+    """
+    menu_item = standard_menu['Miso Soup']
+    
+    order = Order(table_number=16, status='pending', total=9.00, is_delivery=False)
+    db.session.add(order)
+    db.session.flush()
+    db.session.add(OrderItem(order_id=order.id, menu_item_id=menu_item.id, quantity=2))
+    db.session.commit()
+    
+    order_id = order.id
+    db.session.expunge_all()
+    
+    with app.test_request_context(f'/order/confirmation/{order_id}'):
+        response = order_confirmation(order_id)
+    assert response.status_code == 200
+    assert '$9' in response.get_data(as_text=True)
+    
+    print("✓ Order confirmation without unit price integration test passed")
+
+
+def test_order_confirmation_url_matches_route(app):
+    """
+    Integration test: Precomputed confirmation URL matches the URL map
+    
+    Tests that the static ORDER_CONFIRMATION_URL pattern used by
+    create_order stays in sync with the order_confirmation route.
+    """
+    with app.test_request_context():
+        expected = url_for('main.order_confirmation', order_id=42, token='abc-123_XY')
+        assert ORDER_CONFIRMATION_URL.format(order_id=42, token='abc-123_XY') == expected
         
-        print("✓ Cart persistence integration test passed")
+        print("✓ Order confirmation URL integration test passed")
 
 
-def test_multiple_orders_same_table(app, db_session):
+def test_order_confirmation_is_conditional(app, db_session, standard_menu):
+    """
+    Integration test: Confirmation page supports HTTP revalidation
+    
+    Tests that the confirmation page carries an ETag and cache headers, and
+    that a refresh with a matching If-None-Match gets a 304 without a body.
     """
-    Integration test: Multiple orders from same table using same token
+    token = get_or_create_table_token(14)
     
-    Tests that a table can place multiple orders using the same QR token
-    without issues, verifying token reuse works correctly.
+    menu_item = standard_menu['Edamame']
     
-    Validates: Requirements 1.1, 1.2, 1.3
+    order = make_order(token, menu_item)
+    url = f'/order/confirmation/{order.id}'
+    
+    with app.test_request_context(url):
+        response = order_confirmation(order.id)
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'private, max-age=3600'
+    etag = response.headers['ETag']
+    
+    with app.test_request_context(url, headers={'If-None-Match': etag}):
+        response = order_confirmation(order.id)
+    assert response.status_code == 304
+    assert response.get_data() == b''
+    
+    # A status change produces a new ETag
+    order.status = 'completed'
+    db.session.commit()
+    with app.test_request_context(url, headers={'If-None-Match': etag}):
+        response = order_confirmation(order.id)
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    
+    print("✓ Order confirmation conditional request integration test passed")
+
+
+def test_create_order_rejects_oversized_and_malformed_bodies(app, db_session):
     """
-    with app.app_context():
-        # Create token and menu item
-        token = get_or_create_table_token(20)
-        
-        menu_item = MenuItem(
-            name="Green Tea",
-            description="Hot green tea",
-            price=3.00,
-            category="Beverages",
-            available=True
-        )
-        db.session.add(menu_item)
-        db.session.commit()
-        
-        # Place first order
-        order1 = create_order_from_token(
-            token_string=token.token,
-            customer_name='First Order',
-            instructions='',
-            items=[{'id': menu_item.id, 'quantity': 2}]
-        )
-        
-        assert order1 is not None
-        assert order1.table_number == 20
-        
-        # Place second order with same token
-        order2 = create_order_from_token(
-            token_string=token.token,
-            customer_name='Second Order',
-            instructions='',
-            items=[{'id': menu_item.id, 'quantity': 1}]
-        )
-        
-        assert order2 is not None
-        assert order2.table_number == 20
-        assert order1.id != order2.id
-        
-        # Verify token was reused (only one token exists for table 20)
-        tokens = TableToken.query.filter_by(table_number=20, is_active=True).all()
-        assert len(tokens) == 1
-        
-        print("✓ Multiple orders same table integration test passed")
+    Integration test: create_order answers 413 and 400 for bad request bodies
+    
+    Tests that a body larger than MAX_CONTENT_LENGTH surfaces as a 413
+    instead of a 500, and that a body that is not JSON gets a 400.
+    """
+    oversized = '{"items": [], "padding": "' + 'x' * app.config['MAX_CONTENT_LENGTH'] + '"}'
+    with app.test_request_context('/create_order', method='POST', data=oversized,
+                                  content_type='application/json'):
+        with pytest.raises(RequestEntityTooLarge) as excinfo:
+            create_order()
+    assert excinfo.value.code == 413
+    
+    with app.test_request_context('/create_order', method='POST', data='{not json',
+                                  content_type='application/json'):
+        response, status = create_order()
+    assert status == 400
+    assert response.get_json() == {'error': 'No se recibieron datos'}
+    
+    print("✓ Create order request body validation integration test passed")
@@ -7,13 +7,18 @@ and SocketIO real-time updates.
 """
 import pytest
 import json
-from app.models import TableToken, MenuItem, Order, OrderItem
-from app.admin.routes import get_or_create_table_token
-from app.main.routes import create_order_from_token
-from app import db
+import sqlite3
+from sqlalchemy import event, func
+from app.models import Order, OrderItem
+from app.main.routes import (
+    queue_new_order_notification,
+    NEW_ORDERS_BATCH_INTERVAL
+)
+from app import db, socketio
+from tests.helpers import make_order
 
 
-def test_kitchen_display_shows_table_numbers(app, db_session):
+def test_kitchen_display_shows_table_numbers(db_session, standard_menu, token_factory):
     """
     Integration test: Kitchen display shows table numbers for orders
     
@@ -22,63 +27,49 @@ def test_kitchen_display_shows_table_numbers(app, db_session):
     
     Validates: Requirements 2.4, 6.2
     """
-    with app.app_context():
-        # Create tokens for multiple tables
-        token1 = get_or_create_table_token(5)
-        token2 = get_or_create_table_token(12)
-        
-        # Create menu items
-        menu_item = MenuItem(
-            name="Tempura Roll",
-            description="Crispy tempura",
-            price=14.00,
-            category="Rolls",
-            available=True
-        )
-        db.session.add(menu_item)
-        db.session.commit()
-        
-        # Create orders from different tables
-        order1 = create_order_from_token(
-            token_string=token1.token,
-            customer_name='Customer 1',
-            instructions='',
-            items=[{'id': menu_item.id, 'quantity': 1}]
-        )
-        
-        order2 = create_order_from_token(
-            token_string=token2.token,
-            customer_name='Customer 2',
-            instructions='',
-            items=[{'id': menu_item.id, 'quantity': 2}]
-        )
-        
-        assert order1 is not None
-        assert order2 is not None
-        
-        # Query pending orders (simulating kitchen display query)
-        kitchen_orders = Order.query.filter_by(
-            is_delivery=False,
-            status='pending'
-        ).all()
-        
-        # Verify both orders appear with correct table numbers
-        assert len(kitchen_orders) >= 2
-        
-        table_numbers = [order.table_number for order in kitchen_orders]
-        assert 5 in table_numbers
-        assert 12 in table_numbers
+    # Tokens for multiple tables
+    token1 = token_factory(5)
+    token2 = token_factory(12)
+    
+    menu_item = standard_menu['Tempura Roll']
+    
+    # Create orders from different tables
+    order1 = make_order(token1, menu_item, name='Customer 1')
+    
+    order2 = make_order(token2, menu_item, 2, name='Customer 2')
+    
+    assert order1 is not None
+    assert order2 is not None
+    
+    # Query pending orders (simulating kitchen display query) as one
+    # aggregation, so the assertions never hydrate Order.items; the outer
+    # join keeps orders without items, with n == 0
+    rows = db.session.query(
+        Order.id,
+        Order.table_number,
+        Order.total,
+        func.count(OrderItem.id).label('n')
+    ).outerjoin(OrderItem).filter(
+        Order.status == 'pending',
+        Order.is_delivery == False
+    ).group_by(Order.id).all()
+    
+    # Verify both orders appear with correct table numbers
+    assert len(rows) >= 2
+    
+    table_numbers = [row.table_number for row in rows]
+    assert 5 in table_numbers
+    assert 12 in table_numbers
+    
+    # Verify order details
+    assert all(row.table_number is not None for row in rows)
+    assert all(row.n > 0 for row in rows)
+    assert all(row.total > 0 for row in rows)
         
-        # Verify order details
-        for order in kitchen_orders:
-            assert order.table_number is not None
-            assert len(order.items) > 0
-            assert order.total > 0
-            
-        print("✓ Kitchen display table numbers integration test passed")
+    print("✓ Kitchen display table numbers integration test passed")
 
 
-def test_kitchen_display_handles_legacy_orders(app, db_session):
+def test_kitchen_display_handles_legacy_orders(db_session, standard_menu):
     """
     Integration test: Kitchen display handles orders without table numbers
     
@@ -87,75 +78,65 @@ def test_kitchen_display_handles_legacy_orders(app, db_session):
     
     Validates: Requirements 6.5
     """
-    with app.app_context():
-        # Create a menu item
-        menu_item = MenuItem(
-            name="Edamame",
-            description="Steamed soybeans",
-            price=5.00,
-            category="Appetizers",
-            available=True
-        )
-        db.session.add(menu_item)
-        db.session.commit()
-        
-        # Note: The current schema requires table_number (NOT NULL constraint)
-        # This is correct per requirements - all new orders must have table numbers
-        # Legacy orders in production DB would have been created before the constraint
-        
-        # Verify that attempting to create order without table number fails
-        # This validates that the system enforces table number requirement
-        try:
-            legacy_order = Order(
-                table_number=None,  # Should fail
-                status='pending',
-                total=5.00,
-                is_delivery=False
-            )
-            db.session.add(legacy_order)
-            db.session.commit()
-            # If we get here, the constraint isn't working
-            assert False, "Should have raised IntegrityError for NULL table_number"
-        except Exception as e:
-            # Expected - table_number is required
-            db.session.rollback()
-            assert "NOT NULL constraint failed" in str(e) or "IntegrityError" in str(type(e).__name__)
-        
-        # Create a valid order with table number to verify system works
-        valid_order = Order(
-            table_number=99,  # Valid table number
+    menu_item = standard_menu['Edamame']
+    
+    # Note: The current schema requires table_number (NOT NULL constraint)
+    # This is correct per requirements - all new orders must have table numbers
+    # Legacy orders in production DB would have been created before the constraint
+    
+    # Verify that attempting to create order without table number fails
+    # This validates that the system enforces table number requirement
+    try:
+        legacy_order = Order(
+            table_number=None,  # Should fail
             status='pending',
             total=5.00,
             is_delivery=False
         )
-        db.session.add(valid_order)
-        
-        order_item = OrderItem(
-            order=valid_order,
-            menu_item_id=menu_item.id,
-            quantity=1
-        )
-        db.session.add(order_item)
+        db.session.add(legacy_order)
         db.session.commit()
+        # If we get here, the constraint isn't working
+        assert False, "Should have raised IntegrityError for NULL table_number"
+    except Exception as e:
+        # Expected - table_number is required
+        db.session.rollback()
+        assert "NOT NULL constraint failed" in str(e) or "IntegrityError" in str(type(e).__name__)
+    
+    # Create a valid order with table number to verify system works
+    valid_order = Order(
+        table_number=99,  # Valid table number
+        status='pending',
+        total=5.00,
+        is_delivery=False
+    )
+    db.session.add(valid_order)
+    db.session.flush()
+    
+    # Insert the items with a single executemany
+    db.session.bulk_insert_mappings(OrderItem, [
+        {'order_id': valid_order.id, 'menu_item_id': menu_item.id,
+         'quantity': 1, 'unit_price': menu_item.price}
+    ])
+    db.session.commit()
+    
+    # Query kitchen orders - should work fine
+    kitchen_orders = Order.query.filter_by(
+        is_delivery=False,
+        status='pending'
+    ).all()
+    
+    # Verify valid order appears
+    assert any(o.id == valid_order.id for o in kitchen_orders)
+    
+    # Verify all orders have table numbers (as required)
+    for order in kitchen_orders:
+        assert order.table_number is not None
+        assert isinstance(order.table_number, int)
         
-        # Query kitchen orders - should work fine
-        kitchen_orders = Order.query.filter_by(
-            is_delivery=False,
-            status='pending'
-        ).all()
-        
-        # Verify valid order appears
-        assert any(o.id == valid_order.id for o in kitchen_orders)
-        
-        # Verify all orders have table numbers (as required)
-        for order in kitchen_orders:
-            assert order.table_number is not None
-            assert isinstance(order.table_number, int)
-            
-        print("✓ Kitchen display legacy orders integration test passed")
+    print("✓ Kitchen display legacy orders integration test passed")
 
 
-def test_order_completion_workflow(app, db_session):
+def test_order_completion_workflow(db_session, standard_menu, token_factory):
     """
     Integration test: Complete order workflow in kitchen
     
@@ -164,53 +145,36 @@ def test_order_completion_workflow(app, db_session):
     
     Validates: Requirements 6.2
     """
-    with app.app_context():
-        # Create token and menu item
-        token = get_or_create_table_token(8)
-        
-        menu_item = MenuItem(
-            name="Sashimi Platter",
-            description="Assorted fresh fish",
-            price=25.00,
-            category="Sashimi",
-            available=True
-        )
-        db.session.add(menu_item)
-        db.session.commit()
-        
-        # Create order
-        order = create_order_from_token(
-            token_string=token.token,
-            customer_name='Customer',
-            instructions='',
-            items=[{'id': menu_item.id, 'quantity': 1}]
-        )
-        
-        assert order is not None
-        order_id = order.id
-        
-        # Verify order appears in pending orders
-        pending_orders = Order.query.filter_by(status='pending').all()
-        order_ids = [o.id for o in pending_orders]
-        assert order_id in order_ids
-        
-        # Complete the order
-        order.status = 'completed'
-        db.session.commit()
-        
-        # Verify order is marked as completed
-        completed_order = Order.query.get(order_id)
-        assert completed_order.status == 'completed'
-        
-        # Verify order no longer appears in pending orders
-        pending_orders = Order.query.filter_by(status='pending').all()
-        order_ids = [o.id for o in pending_orders]
-        assert order_id not in order_ids
-        
-        print("✓ Order completion workflow integration test passed")
+    token = token_factory(8)
+    menu_item = standard_menu['Sashimi Platter']
+    
+    # Create order
+    order = make_order(token, menu_item)
+    
+    assert order is not None
+    order_id = order.id
+    
+    # Verify order appears in pending orders
+    order_ids = [row[0] for row in db.session.query(Order.id).filter_by(status='pending').all()]
+    assert order_id in order_ids
+    
+    # Complete the order
+    order.status = 'completed'
+    db.session.commit()
+    
+    # Verify order is marked as completed
+    completed_order = Order.query.get(order_id)
+    assert completed_order.status == 'completed'
+    
+    # Verify order no longer appears in pending orders
+    order_ids = [row[0] for row in db.session.query(Order.id).filter_by(status='pending').all()]
+    assert order_id not in order_ids
+    
+    print("✓ Order completion workflow integration test passed")
 
 
-def test_concurrent_orders_different_tables(app, db_session):
+@pytest.mark.slow
+def test_concurrent_orders_different_tables(db_session, standard_menu, token_factory):
     """
     Integration test: Multiple concurrent orders from different tables
     
@@ -219,47 +183,110 @@ def test_concurrent_orders_different_tables(app, db_session):
     
     Validates: Requirements 7.5
     """
-    with app.app_context():
-        # Create tokens for multiple tables
-        tokens = [get_or_create_table_token(i) for i in range(1, 6)]
-        
-        # Create menu item
-        menu_item = MenuItem(
-            name="Ramen Bowl",
-            description="Traditional ramen",
-            price=12.00,
-            category="Noodles",
-            available=True
-        )
-        db.session.add(menu_item)
-        db.session.commit()
-        
-        # Submit orders from all tables
-        orders = []
-        for token in tokens:
-            order = create_order_from_token(
-                token_string=token.token,
-                customer_name='Customer',
-                instructions='',
-                items=[{'id': menu_item.id, 'quantity': 1}]
-            )
-            assert order is not None
-            orders.append(order)
-        
-        # Verify all orders were created with correct table numbers
-        for i, order in enumerate(orders):
-            assert order.table_number == i + 1
-            assert order.status == 'pending'
-        
-        # Verify all orders appear in kitchen
-        kitchen_orders = Order.query.filter_by(
-            is_delivery=False,
-            status='pending'
-        ).all()
-        
-        kitchen_order_ids = [o.id for o in kitchen_orders]
-        
-        for order in orders:
-            assert order.id in kitchen_order_ids
+    # Tokens for multiple tables
+    tokens = [token_factory(i) for i in range(1, 6)]
+    
+    menu_item = standard_menu['Ramen Bowl']
+    
+    # Submit orders from all tables
+    orders = []
+    for token in tokens:
+        order = make_order(token, menu_item)
+        assert order is not None
+        orders.append(order)
+    
+    # Verify all orders were created with correct table numbers
+    for i, order in enumerate(orders):
+        assert order.table_number == i + 1
+        assert order.status == 'pending'
+    
+    # Verify all orders appear in kitchen
+    kitchen_order_ids = [row[0] for row in db.session.query(Order.id).filter_by(
+        is_delivery=False,
+        status='pending'
+    ).all()]
+    
+    for order in orders:
+        assert order.id in kitchen_order_ids
+    
+    print("✓ Concurrent orders integration test passed")
+
+
+def test_new_order_notifications_are_batched(db_session, monkeypatch):
+    """
+    Integration test: Kitchen receives new orders in batches
+    
+    Tests that several order notifications queued close together reach
+    the kitchen as a single SocketIO event.
+    """
+    emitted = []
+    monkeypatch.setattr(
+        socketio, 'emit',
+        lambda event, data, **kwargs: emitted.append((event, data))
+    )
+    
+    order1 = Order(table_number=3, status='pending', total=10.0, is_delivery=False)
+    order2 = Order(table_number=4, status='pending', total=20.0, is_delivery=False)
+    db.session.add_all([order1, order2])
+    db.session.commit()
+    
+    queue_new_order_notification(order1.id)
+    queue_new_order_notification(order2.id)
+    socketio.sleep(NEW_ORDERS_BATCH_INTERVAL * 4)
+    
+    assert len(emitted) == 1
+    event, batch = emitted[0]
+    assert event == 'new_orders_batch'
+    assert [o['table_number'] for o in batch] == [3, 4]
+    assert [o['total'] for o in batch] == [10.0, 20.0]
+    
+    print("✓ Kitchen notification batching integration test passed")
+
+
+def test_new_order_notifications_survive_a_failed_batch(db_session, monkeypatch):
+    """
+    Integration test: A failed notification batch does not stop later ones
+    
+    Tests that when the flusher's query raises (e.g. SQLite "database is
+    locked"), the batch is dropped and later orders still reach the kitchen.
+    """
+    emitted = []
+    monkeypatch.setattr(
+        socketio, 'emit',
+        lambda event, data, **kwargs: emitted.append((event, data))
+    )
+    
+    order1 = Order(table_number=6, status='pending', total=10.0, is_delivery=False)
+    order2 = Order(table_number=7, status='pending', total=20.0, is_delivery=False)
+    db.session.add_all([order1, order2])
+    db.session.commit()
+    order1_id, order2_id = order1.id, order2.id
+    
+    # The next batch query fails once
+    failures = []
+    connection = db.session.connection()
+    
+    def fail_once(conn, cursor, statement, parameters, context, executemany):
+        if not failures and statement.startswith('SELECT') and '"order"' in statement:
+            failures.append(statement)
+            raise sqlite3.OperationalError('database is locked')
+    
+    event.listen(connection, 'before_cursor_execute', fail_once)
+    try:
+        queue_new_order_notification(order1_id)
+        socketio.sleep(NEW_ORDERS_BATCH_INTERVAL * 4)
         
-        print("✓ Concurrent orders integration test passed")
+        queue_new_order_notification(order2_id)
+        socketio.sleep(NEW_ORDERS_BATCH_INTERVAL * 4)
+    finally:
+        event.remove(connection, 'before_cursor_execute', fail_once)
+    
+    assert len(failures) == 1
+    assert emitted == [('new_orders_batch', [{
+        'order_id': order2_id,
+        'table_number': 7,
+        'is_delivery': False,
+        'total': 20.0
+    }])]
+    
+    print("✓ Kitchen notification recovery integration test passed")
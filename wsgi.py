@@ -1,11 +1,23 @@
 """
 WSGI entry point for Vercel deployment
 """
-from app import create_app, socketio
+from app import create_app
 
-app = create_app()
+_app_singleton = None
+
+
+def get_app():
+    """Return the application, creating it only once per process."""
+    global _app_singleton
+    if _app_singleton is None:
+        _app_singleton = create_app()
+    return _app_singleton
+
+
+app = get_app()
 
 # For Vercel, we need to expose the app object
 # SocketIO will be handled differently in production
 if __name__ == "__main__":
+    from app import socketio
     socketio.run(app)